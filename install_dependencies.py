@@ -59,6 +59,11 @@ try:
 except:
     install_with_pip("seaborn")
 
+try:
+    import pyarrow
+except:
+    install_with_pip("pyarrow")
+
 try:
     import sa_gwdata
 except:
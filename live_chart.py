@@ -0,0 +1,199 @@
+import matplotlib.pyplot as plt
+
+from qgis.core import NULL, QgsProject
+
+from .install_dependencies import *
+
+import pandas as pd
+import seaborn as sns
+
+from .plugin_tasks import *
+from .utils import *
+
+
+class LiveChart:
+    """Chart of the wells selected in the plugin's wells layer, which is
+    updated whenever the selection changes.
+
+    Args:
+        plugin (SAGwDataPlugin object): the plugin object
+        chart_cls (class): WaterLevelPlotTask or SalinityPlotTask, which
+            sets the data to download and how it is plotted.
+        paramcol (str): name of column with data
+        ylabel (str): y-axis label for chart
+        on_close (callable): optional, called when the figure is closed.
+
+    Only wells newly added to the selection have their data fetched, and
+    that data comes from the plugin's observation cache where possible.
+    Wells removed from the selection have their lines removed. Each well
+    keeps its colour while it stays selected.
+
+    """
+
+    def __init__(self, plugin, chart_cls, paramcol, ylabel, on_close=None):
+        self.plugin = plugin
+        self.chart_cls = chart_cls
+        self.paramcol = paramcol
+        self.on_close = on_close
+        self.layer = plugin.wells_layer
+        self.wells = {}
+        self.data = {}
+        self.artists = {}
+        self.colours = {}
+        self.extra_artists = []
+        self.pending = set()
+        self.layer_id = None
+        self.running = True
+        self.palette = sns.color_palette("bright", 10)
+
+        self.fig = plt.figure()
+        self.ax = self.fig.add_subplot(111)
+        chart_cls.setup_axes(self.ax, paramcol, ylabel)
+        self.fig.canvas.mpl_connect("close_event", self.closed)
+        self.layer.selectionChanged.connect(self.selection_changed)
+        self.selection_changed()
+        self.fig.show()
+
+    def stop(self):
+        """Stop following the selection. The figure is left open."""
+        if not self.running:
+            return
+        self.running = False
+        try:
+            self.layer.selectionChanged.disconnect(self.selection_changed)
+        except (TypeError, RuntimeError):
+            # The layer has already been deleted.
+            pass
+
+    def closed(self, event):
+        self.stop()
+        if self.on_close is not None:
+            self.on_close()
+
+    def next_colour(self):
+        """Return the first colour in the palette which is not in use."""
+        used = list(self.colours.values())
+        for colour in self.palette:
+            if not colour in used:
+                return colour
+        return self.palette[len(used) % len(self.palette)]
+
+    def selection_changed(self, *args):
+        """Update the chart to match the selection in the wells layer."""
+        names = self.layer.fields().names()
+        selected = {}
+        for feature in self.layer.selectedFeatures():
+            vals = dict(zip(names, feature.attributes()))
+            label = vals["well_id"]
+            if vals["aq_mon"] and vals["aq_mon"] != NULL:
+                label += " {}".format(vals["aq_mon"])
+            selected[int(vals["dh_no"])] = (vals["well_id"], label)
+
+        for dh_no in [x for x in self.wells if not x in selected]:
+            self.remove_well(dh_no)
+        added = [x for x in selected if not x in self.wells]
+        for dh_no in added:
+            self.wells[dh_no] = selected[dh_no]
+
+        service = self.chart_cls.bulk_download_service
+        cached = self.plugin.obs_cache.dh_nos(service)
+        from_cache = [x for x in added if x in cached]
+        to_fetch = [x for x in added if not x in cached and not x in self.pending]
+        if from_cache:
+            self.add_data(self.plugin.obs_cache.get(service, from_cache))
+        if to_fetch:
+            self.pending.update(to_fetch)
+            self.plugin.run_task(
+                FetchObservationsTask(self.plugin, service, to_fetch, self.data_fetched)
+            )
+        self.redraw()
+
+    def data_fetched(self, dh_nos, df):
+        """Called by FetchObservationsTask when it has finished. If the
+        fetch failed, the wells are forgotten so that the next change to
+        the selection fetches them again."""
+        self.pending.difference_update(dh_nos)
+        if df is None:
+            for dh_no in dh_nos:
+                if not dh_no in self.artists:
+                    self.wells.pop(dh_no, None)
+            return
+        if not self.running:
+            return
+        self.add_data(df)
+        self.redraw()
+
+    def add_data(self, df):
+        """Plot data for selected wells which are not already plotted."""
+        if not len(df):
+            return
+        df = prepare_observations(df, self.chart_cls.datecol, self.paramcol)
+        for dh_no, wdf in df.groupby("DHNO"):
+            dh_no = int(dh_no)
+            if not dh_no in self.wells or dh_no in self.artists:
+                continue
+            well_id, label = self.wells[dh_no]
+            self.colours[dh_no] = self.next_colour()
+            self.data[dh_no] = wdf
+            self.artists[dh_no] = self.chart_cls.plot_well(
+                self.ax, wdf, self.paramcol, label, self.colours[dh_no]
+            )
+
+    def styles(self):
+        """Return the table of colours and labels of the charted wells, as
+        made by ``well_styles``."""
+        dh_nos = list(self.artists.keys())
+        return pd.DataFrame(
+            {
+                "colour": [self.colours[x] for x in dh_nos],
+                "label": [self.wells[x][1] for x in dh_nos],
+            },
+            index=pd.Index([self.wells[x][0] for x in dh_nos], name="well_id"),
+        )
+
+    def remove_well(self, dh_no):
+        for artist in self.artists.pop(dh_no, []):
+            artist.remove()
+        self.colours.pop(dh_no, None)
+        self.data.pop(dh_no, None)
+        self.wells.pop(dh_no, None)
+
+    def redraw(self):
+        """Update the legend, axes limits and highlight layer."""
+        for artist in self.extra_artists:
+            artist.remove()
+        self.extra_artists = []
+        if self.data:
+            self.extra_artists = self.chart_cls.plot_legend_extras(
+                self.ax, pd.concat(list(self.data.values()), sort=False)
+            )
+            self.ax.legend(loc="best", frameon=False, fontsize="small")
+        elif self.ax.get_legend() is not None:
+            self.ax.get_legend().remove()
+        self.ax.relim()
+        self.ax.autoscale_view()
+        self.fig.canvas.draw_idle()
+        self.update_layer()
+
+    def update_layer(self):
+        """Show the charted wells in the figure's highlight layer."""
+        dh_nos = list(self.artists.keys())
+        layer = None
+        if self.layer_id is not None:
+            layer = QgsProject.instance().mapLayer(self.layer_id)
+        if layer is None:
+            layer = highlight_layer(
+                self.layer,
+                dh_nos,
+                name="Fig {:.0f} {} (live)".format(self.fig.number, self.paramcol),
+            )
+            self.plugin.set_figure_layer(self.fig.number, layer)
+            self.layer_id = layer.id()
+        else:
+            layer.setDataSource(
+                highlight_layer_source(self.layer, dh_nos), layer.name(), "virtual"
+            )
+        layer.setRenderer(well_id_renderer(layer.geometryType(), self.styles()))
+        layer.triggerRepaint()
+        self.plugin.iface.layerTreeView().refreshLayerSymbology(layer.id())
+        self.plugin.iface.setActiveLayer(self.layer)
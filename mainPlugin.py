@@ -1,4 +1,5 @@
 from pathlib import Path
+import functools
 import os
 import struct
 import subprocess
@@ -16,7 +17,12 @@ from qgis.core import *
 
 # Install all required dependencies into QGIS' Python environment.
 from .install_dependencies import *
+from .live_chart import *
 from .plugin_tasks import *
+from .replay import *
+from .request_engine import *
+from .search import *
+from .snapshot import *
 from .utils import *
 
 __version__ = "0.1.0"
@@ -30,16 +36,289 @@ class SAGwDataPlugin:
         self.actions = []
         self.path = Path(os.path.dirname(os.path.abspath(__file__)))
         self.wells_layer = None
+        self.figure_layers = {}
+        self.live_charts = {}
+        settings = QgsSettings()
+        self.obs_cache = ObservationCache(
+            max_age=settings.value("sa_gwdata/cache_max_age", 3600, type=float),
+            max_rows=settings.value("sa_gwdata/cache_max_rows", 1000000, type=int),
+        )
+        self.search_index = WellSearchIndex()
+        self.request_engine = None
+        self.engine_tasks = EngineTaskRunner()
+        self.session_factory = sa_gwdata.WaterConnectSession
+        self.row_cap = WATERCONNECT_ROW_CAP
+        self.recorder = None
+        self.replay_server = None
         for layer in self.iface.mapCanvas().layers():
             if layer.isValid():
                 if layer.name() == "sa_gwdata wells":
                     self.wells_layer = layer
                     self.wells_layer.destroyed.connect(self.wells_layer_removed)
+                    self.search_index.add_layer(layer)
 
         self.wc_session = sa_gwdata.WaterConnectSession()
 
     def wells_layer_removed(self):
         self.wells_layer = None
+        for action in list(self.live_charts.keys()):
+            action.setChecked(False)
+        self.search_index.clear()
+        for fignum in list(self.figure_layers.keys()):
+            self.remove_figure_layer(fignum)
+
+    def get_request_engine(self):
+        """Return the request engine, or None if the user has not turned
+        it on. The engine is started the first time it is needed.
+
+        The "sa_gwdata/max_requests_per_host" and "sa_gwdata/request_timeout"
+        settings control how it runs.
+
+        """
+        settings = QgsSettings()
+        if not settings.value("sa_gwdata/use_request_engine", False, type=bool):
+            return None
+        if self.request_engine is None:
+            self.request_engine = RequestEngine(
+                self.session_factory,
+                max_per_host=settings.value(
+                    "sa_gwdata/max_requests_per_host", 4, type=int
+                ),
+                timeout=settings.value("sa_gwdata/request_timeout", 120, type=int),
+            )
+        return self.request_engine
+
+    def set_use_request_engine(self, checked):
+        QgsSettings().setValue("sa_gwdata/use_request_engine", checked)
+
+    def shutdown_request_engine(self):
+        """Stop the request engine, e.g. so that the next task starts a new
+        one with the current session factory."""
+        if self.request_engine is not None:
+            self.request_engine.shutdown()
+            self.request_engine = None
+
+    def set_session_factory(self, session_factory, row_cap=WATERCONNECT_ROW_CAP):
+        """Change how tasks create WaterConnect sessions.
+
+        Args:
+            session_factory (callable): returns a new session object
+            row_cap (int): the maximum number of wells the sessions
+                return per request.
+
+        """
+        self.session_factory = session_factory
+        self.row_cap = row_cap
+        self.shutdown_request_engine()
+
+    def replay_settings(self):
+        """Return keyword arguments for ReplayServer from QgsSettings."""
+        settings = QgsSettings()
+        return {
+            "latency": settings.value("sa_gwdata/replay_latency", 0.2, type=float),
+            "jitter": settings.value("sa_gwdata/replay_jitter", 0.1, type=float),
+            "error_rate": settings.value("sa_gwdata/replay_error_rate", 0, type=float),
+            "row_cap": settings.value(
+                "sa_gwdata/replay_row_cap", WATERCONNECT_ROW_CAP, type=int
+            ),
+        }
+
+    def set_recording(self, checked):
+        """Start recording WaterConnect responses, or stop and save them to
+        the fixture file chosen by the user."""
+        if checked:
+            self.replay_action.action.setChecked(False)
+            recorder = FixtureRecorder()
+            self.set_session_factory(
+                lambda: RecordingSession(sa_gwdata.WaterConnectSession(), recorder)
+            )
+            self.recorder = recorder
+        elif self.recorder is not None:
+            self.set_session_factory(sa_gwdata.WaterConnectSession)
+            filename, _ = QFileDialog.getSaveFileName(
+                self.iface.mainWindow(),
+                "Save recorded responses",
+                "",
+                SNAPSHOT_FILE_FILTER,
+            )
+            if filename:
+                self.recorder.save(filename)
+            self.recorder = None
+
+    def set_replay(self, checked):
+        """Start serving WaterConnect responses from a fixture file chosen
+        by the user, or go back to using WaterConnect."""
+        if checked:
+            filename, _ = QFileDialog.getOpenFileName(
+                self.iface.mainWindow(), "Replay responses", "", SNAPSHOT_FILE_FILTER
+            )
+            if not filename:
+                self.replay_action.action.setChecked(False)
+                return
+            self.record_action.action.setChecked(False)
+            self.replay_server = ReplayServer(filename, **self.replay_settings())
+            url = self.replay_server.url
+            self.set_session_factory(
+                lambda: ReplaySession(url), row_cap=self.replay_server.row_cap
+            )
+        elif self.replay_server is not None:
+            self.set_session_factory(sa_gwdata.WaterConnectSession)
+            self.replay_server.shutdown()
+            self.replay_server = None
+
+    def run_load_test(self):
+        """Run a LoadTestTask against a fixture file chosen by the user.
+
+        The "sa_gwdata/load_test_concurrency" setting is a comma-separated
+        list of the concurrency levels to test.
+
+        """
+        filename, _ = QFileDialog.getOpenFileName(
+            self.iface.mainWindow(), "Load test", "", SNAPSHOT_FILE_FILTER
+        )
+        if not filename:
+            return
+        settings = QgsSettings()
+        concurrency_levels = [
+            int(x)
+            for x in settings.value(
+                "sa_gwdata/load_test_concurrency", "1,2,4,8,16"
+            ).split(",")
+        ]
+        self.run_task(
+            LoadTestTask(
+                self,
+                filename,
+                concurrency_levels=concurrency_levels,
+                timeout=settings.value("sa_gwdata/request_timeout", 120, type=int),
+                **self.replay_settings()
+            )
+        )
+
+    def add_wells_df(self, wells_df):
+        """Merge wells into the plugin's "wells" layer, creating the layer
+        and adding it to the project if necessary.
+
+        Args:
+            wells_df (pandas.DataFrame): wells, with the columns produced
+                by FindMapCanvasWellsTask.
+
+        """
+        wells_layer_existed = self.wells_layer != None
+        self.wells_layer = df_to_vector_layer(
+            wells_df,
+            vlayer=self.wells_layer,
+            name="sa_gwdata wells",
+            search_index=self.search_index,
+        )
+        if not wells_layer_existed:
+            self.wells_layer.destroyed.connect(self.wells_layer_removed)
+        if not self.wells_layer in self.iface.mapCanvas().layers():
+            self.wells_layer.loadNamedStyle(str(self.path / "well_id_labels.qml"))
+            QgsProject.instance().addMapLayer(self.wells_layer)
+
+    def export_snapshot(self):
+        """Save the loaded wells and cached observation data to a snapshot
+        file chosen by the user."""
+        if self.wells_layer is None:
+            self.iface.messageBar().pushMessage(
+                "SA Groundwater Data", "No wells have been loaded.", level=Qgis.Warning
+            )
+            return
+        filename, _ = QFileDialog.getSaveFileName(
+            self.iface.mainWindow(), "Export snapshot", "", SNAPSHOT_FILE_FILTER
+        )
+        if not filename:
+            return
+        if os.path.realpath(filename) in self.obs_cache.mapped_files:
+            self.iface.messageBar().pushMessage(
+                "SA Groundwater Data",
+                "{} was imported in this session and cannot be overwritten; "
+                "choose another file.".format(filename),
+                level=Qgis.Warning,
+            )
+            return
+        self.run_task(ExportSnapshotTask(self, filename))
+
+    def import_snapshot(self):
+        """Load wells and observation data from a snapshot file chosen by
+        the user."""
+        filename, _ = QFileDialog.getOpenFileName(
+            self.iface.mainWindow(), "Import snapshot", "", SNAPSHOT_FILE_FILTER
+        )
+        if not filename:
+            return
+        self.run_task(ImportSnapshotTask(self, filename))
+
+    def clear_cache(self):
+        """Drop all downloaded observation data, so that it is downloaded
+        again when it is next charted."""
+        self.obs_cache.clear()
+        self.iface.messageBar().pushMessage(
+            "SA Groundwater Data",
+            "Cached observation data cleared",
+            level=Qgis.Info,
+        )
+
+    def set_live_chart(self, action, chart_cls, paramcol, ylabel, checked):
+        """Start or stop a LiveChart of the selected wells.
+
+        Args:
+            action (QAction): the checkable menu item for the chart, which
+                is unchecked when the chart's figure is closed.
+            chart_cls, paramcol, ylabel: see LiveChart.
+            checked (bool): start or stop the chart.
+
+        """
+        if checked and self.wells_layer is None:
+            self.iface.messageBar().pushMessage(
+                "SA Groundwater Data", "No wells have been loaded.", level=Qgis.Warning
+            )
+            action.setChecked(False)
+        elif checked:
+            self.live_charts[action] = LiveChart(
+                self,
+                chart_cls,
+                paramcol,
+                ylabel,
+                on_close=lambda: action.setChecked(False),
+            )
+        elif action in self.live_charts:
+            self.live_charts.pop(action).stop()
+
+    def set_figure_layer(self, fignum, layer):
+        """Add the highlight layer for a chart figure to the project.
+
+        Args:
+            fignum (int): matplotlib figure number
+            layer (QgsVectorLayer): the layer highlighting the charted wells
+
+        Any layer left over from an earlier figure with the same number
+        is removed first, and the layer is removed again when the
+        figure is closed.
+
+        """
+        self.remove_figure_layer(fignum)
+        QgsProject.instance().addMapLayer(layer)
+        self.figure_layers[fignum] = layer.id()
+        layer_id = layer.id()
+        plt.figure(fignum).canvas.mpl_connect(
+            "close_event", lambda event: self.remove_figure_layer(fignum, layer_id)
+        )
+
+    def remove_figure_layer(self, fignum, layer_id=None):
+        """Remove the highlight layer for a chart figure from the project.
+
+        Args:
+            fignum (int): matplotlib figure number
+            layer_id (str): only remove the layer if it has this ID.
+
+        """
+        if layer_id is not None and self.figure_layers.get(fignum) != layer_id:
+            return
+        layer_id = self.figure_layers.pop(fignum, None)
+        if layer_id is not None and QgsProject.instance().mapLayer(layer_id):
+            QgsProject.instance().removeMapLayer(layer_id)
 
     def initGui(self):
         """Method required by QGIS to initialise plugin."""
@@ -86,6 +365,36 @@ class SAGwDataPlugin:
         self.iface.addPluginToMenu("SA &Groundwater Data", tds_for_selected.action)
         self.actions.append(tds_for_selected)
 
+        # Charts which follow the selection in the wells layer.
+        for text, shortcut, chart_cls, paramcol, ylabel in [
+            (
+                "Live chart water levels for selected wells",
+                "Shift+F9",
+                WaterLevelPlotTask,
+                "rswl",
+                "RSWL (m AHD)",
+            ),
+            (
+                "Live chart bulk salinity sample data for selected wells",
+                "Shift+F10",
+                SalinityPlotTask,
+                "TDS",
+                "TDS (mg/L)",
+            ),
+        ]:
+            live_chart = Action(
+                self, QIcon(str(self.path / "icon.png")), text, self.iface.mainWindow()
+            )
+            live_chart.action.setShortcut(shortcut)
+            live_chart.action.setCheckable(True)
+            live_chart.action.toggled.connect(
+                functools.partial(
+                    self.set_live_chart, live_chart.action, chart_cls, paramcol, ylabel
+                )
+            )
+            self.iface.addPluginToMenu("SA &Groundwater Data", live_chart.action)
+            self.actions.append(live_chart)
+
         load_wells_in_browser = Action(
             self,
             QIcon(str(self.path / "icon.png")),
@@ -97,6 +406,76 @@ class SAGwDataPlugin:
         self.iface.addPluginToMenu("SA &Groundwater Data", load_wells_in_browser.action)
         self.actions.append(load_wells_in_browser)
 
+        export_snapshot = Action(
+            self,
+            QIcon(str(self.path / "icon.png")),
+            "Export wells and data to snapshot...",
+            self.iface.mainWindow(),
+        )
+        export_snapshot.action.triggered.connect(self.export_snapshot)
+        self.iface.addPluginToMenu("SA &Groundwater Data", export_snapshot.action)
+        self.actions.append(export_snapshot)
+
+        import_snapshot = Action(
+            self,
+            QIcon(str(self.path / "icon.png")),
+            "Import wells and data from snapshot...",
+            self.iface.mainWindow(),
+        )
+        import_snapshot.action.triggered.connect(self.import_snapshot)
+        self.iface.addPluginToMenu("SA &Groundwater Data", import_snapshot.action)
+        self.actions.append(import_snapshot)
+
+        clear_cache = Action(
+            self, "Clear cached observation data", self.iface.mainWindow()
+        )
+        clear_cache.action.triggered.connect(self.clear_cache)
+        self.iface.addPluginToMenu("SA &Groundwater Data", clear_cache.action)
+        self.actions.append(clear_cache)
+
+        use_request_engine = Action(
+            self,
+            "Download concurrently with the request engine",
+            self.iface.mainWindow(),
+        )
+        use_request_engine.action.setCheckable(True)
+        use_request_engine.action.setChecked(
+            QgsSettings().value("sa_gwdata/use_request_engine", False, type=bool)
+        )
+        use_request_engine.action.toggled.connect(self.set_use_request_engine)
+        self.iface.addPluginToMenu("SA &Groundwater Data", use_request_engine.action)
+        self.actions.append(use_request_engine)
+
+        # Menu items for testing the plugin without WaterConnect.
+        self.record_action = Action(
+            self, "Record WaterConnect responses", self.iface.mainWindow()
+        )
+        self.record_action.action.setCheckable(True)
+        self.record_action.action.toggled.connect(self.set_recording)
+        self.iface.addPluginToMenu("SA &Groundwater Data", self.record_action.action)
+        self.actions.append(self.record_action)
+
+        self.replay_action = Action(
+            self, "Replay recorded WaterConnect responses", self.iface.mainWindow()
+        )
+        self.replay_action.action.setCheckable(True)
+        self.replay_action.action.toggled.connect(self.set_replay)
+        self.iface.addPluginToMenu("SA &Groundwater Data", self.replay_action.action)
+        self.actions.append(self.replay_action)
+
+        load_test = Action(
+            self, "Load test with recorded responses...", self.iface.mainWindow()
+        )
+        load_test.action.triggered.connect(self.run_load_test)
+        self.iface.addPluginToMenu("SA &Groundwater Data", load_test.action)
+        self.actions.append(load_test)
+
+        # Toolbar with a search box for wells which have been loaded.
+        self.toolbar = self.iface.addToolBar("SA Groundwater Data")
+        self.toolbar.setObjectName("SAGwDataToolbar")
+        self.search_box = WellSearchBox(self)
+        self.toolbar.addWidget(self.search_box)
+
     def load_wells_in_browser(self):
         for feature in self.iface.activeLayer().selectedFeatures():
             dh_no = int(feature["dh_no"])
@@ -106,18 +485,20 @@ class SAGwDataPlugin:
                 )
             )
 
-    def wells_layer_df(self):
-        names = self.wells_layer.fields().names()
-        rows = []
-        for feature in self.wells_layer.getFeatures():
-            rows.append(dict(zip(names, feature.attributes())))
-        return pd.DataFrame(rows)
-
     def unload(self):
         """Uninstall plugin. Remove all UI interface elements and disconnect slots
         from signals."""
         for action in self.actions:
             self.iface.removePluginMenu("SA &Groundwater Data", action.action)
+        self.iface.mainWindow().removeToolBar(self.toolbar)
+        self.toolbar.deleteLater()
+        for chart in self.live_charts.values():
+            chart.stop()
+        self.live_charts.clear()
+        self.shutdown_request_engine()
+        if self.replay_server is not None:
+            self.replay_server.shutdown()
+            self.replay_server = None
 
     def run_task(self, task):
         """Run a QgsTask as a global variable (doesn't run if it is local).
@@ -125,7 +506,14 @@ class SAGwDataPlugin:
         Args:
             task (QgsTask): a task to start running.
 
+        Tasks with a ``run_async()`` coroutine are run on the request
+        engine instead, when it is on.
+
         """
+        self.obs_cache.expire()
+        if getattr(task, "engine", None) is not None and hasattr(task, "run_async"):
+            self.engine_tasks.start(task)
+            return
         tag = str(id(task))
         globals()[tag] = task
         QgsApplication.taskManager().addTask(globals()[tag])
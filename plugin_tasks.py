@@ -1,14 +1,16 @@
 from pathlib import Path
+import asyncio
 import os
 import struct
 import subprocess
 import sys
+import time
 import traceback
 import uuid
 
 import matplotlib.pyplot as plt
 
-from qgis.PyQt.QtCore import QVariant
+from qgis.PyQt.QtCore import QObject, QVariant, pyqtSignal
 from qgis.PyQt.QtGui import *
 from qgis.PyQt.QtWidgets import *
 from qgis.core import *
@@ -20,15 +22,153 @@ import pandas as pd
 import seaborn as sns
 import sa_gwdata
 
+from .snapshot import *
 from .utils import *
 
 
+def wells_to_df(wells):
+    """Convert a list of wells returned by ``find_wells_in_lat_lon`` to a
+    pandas.DataFrame. Wells from a ReplaySession are plain dicts."""
+    if len(wells) and isinstance(wells[0], dict):
+        return pd.DataFrame(list(wells))
+    return sa_gwdata.Wells(wells).df()
+
+
+async def find_wells(
+    engine, lats, lons, row_cap=WATERCONNECT_ROW_CAP, task=None, depth=0
+):
+    """Coroutine for a RequestEngine which fetches the wells in a
+    rectangle. If the rectangle has too many wells it is subdivided and
+    the parts are fetched concurrently, up to MAX_SUBDIVISIONS times.
+
+    Args:
+        engine (RequestEngine): the request engine
+        lats (list): min and max latitude
+        lons (list): min and max longitude
+        row_cap (int): the maximum number of wells the service returns
+        task (Task): optional, used for logging.
+        depth (int): the number of times the rectangle has been subdivided.
+
+    Returns: list of wells.
+
+    """
+    if task is not None:
+        task.log("Fetching wells from: lats={}, lons={}".format(lats, lons))
+    wells = await engine.call(
+        WATERCONNECT_HOST,
+        lambda session: session.find_wells_in_lat_lon(lats=lats, lons=lons),
+    )
+    if task is not None:
+        task.log("Found {} wells".format(len(wells)))
+    if len(wells) >= row_cap and depth >= MAX_SUBDIVISIONS:
+        if task is not None:
+            task.log(
+                "Too many wells in a small area; results for "
+                "lats={}, lons={} are truncated".format(lats, lons),
+                level=Qgis.Warning,
+            )
+    elif len(wells) >= row_cap:
+        if task is not None:
+            task.log("Subdividing rectangle and starting again")
+        results = await asyncio.gather(
+            *[
+                find_wells(engine, rect_lats, rect_lons, row_cap, task, depth + 1)
+                for rect_lats, rect_lons in subdivide_rect(lats, lons)
+            ]
+        )
+        wells = [well for result in results for well in result]
+    return wells
+
+
+def well_styles(well_ids, colours, aq_mons):
+    """Make the table of colours and legend labels used for wells on both
+    a chart and its highlight layer.
+
+    Args:
+        well_ids (list): well IDs
+        colours (list): an RGB tuple (with values from 0 to 1) for each well
+        aq_mons (dict): aquifer monitored for each well ID, where known
+
+    Returns: pandas.DataFrame indexed by well_id, with "colour" and
+    "label" columns.
+
+    """
+    styles = pd.DataFrame(
+        {"colour": list(colours), "label": well_ids},
+        index=pd.Index(well_ids, name="well_id"),
+    )
+    aq_mon = styles.index.to_series().map(aq_mons).fillna("").astype(str)
+    has_aq_mon = aq_mon != ""
+    styles.loc[has_aq_mon, "label"] = (
+        styles.label[has_aq_mon] + " " + aq_mon[has_aq_mon]
+    )
+    return styles
+
+
+def prepare_observations(df, datecol, paramcol):
+    """Parse the dates in bulk download data, drop rows without a value
+    and add a "well_id" column.
+
+    Args:
+        df (pandas.DataFrame): data from a bulk download service
+        datecol (str): name of column with observation dates.
+        paramcol (str): name of column with data
+
+    Returns: pandas.DataFrame
+
+    """
+    df[datecol] = pd.to_datetime(df[datecol], format=r"%d/%m/%Y")
+    df = df.dropna(subset=[datecol, paramcol], how="any")
+    df["well_id"] = df.apply(apply_well_id, axis="columns")
+    return df
+
+
+async def bulk_download(engine, service, dh_nos):
+    """Coroutine for a RequestEngine which downloads data for wells in
+    chunks of BULK_DOWNLOAD_CHUNK_SIZE, concurrently.
+
+    Args:
+        engine (RequestEngine): the request engine
+        service (str): name of API endpoint on Groundwater Data
+        dh_nos (list): drillhole numbers
+
+    Returns: pandas.DataFrame
+
+    """
+    chunks = [
+        dh_nos[i : i + BULK_DOWNLOAD_CHUNK_SIZE]
+        for i in range(0, len(dh_nos), BULK_DOWNLOAD_CHUNK_SIZE)
+    ]
+    frames = await asyncio.gather(
+        *[
+            engine.call(
+                WATERCONNECT_HOST,
+                lambda session, chunk: session.bulk_download(
+                    service, {"DHNOs": chunk}
+                ),
+                chunk,
+            )
+            for chunk in chunks
+        ]
+    )
+    return pd.concat(frames, ignore_index=True, sort=False)
+
+
 class Task(QgsTask):
-    """Convenience parent class for tasks."""
+    """Convenience parent class for tasks.
+
+    Tasks which download data can also define a coroutine ``run_async()``,
+    which does the same as ``run()`` using ``self.engine``. When the
+    request engine is on, ``SAGwDataPlugin.run_task`` runs that on the
+    engine with an EngineTaskRunner instead of adding the task to the
+    QGIS task manager.
+
+    """
 
     def __init__(self, plugin):
         self.exception = None
         self.plugin = plugin
+        self.engine = plugin.get_request_engine()
         super().__init__(uuid.uuid4().hex, QgsTask.CanCancel)
 
     def log(self, msg, level=Qgis.Info):
@@ -52,16 +192,96 @@ class Task(QgsTask):
 
         """
         try:
-            self.wc_session = sa_gwdata.WaterConnectSession()
+            self.wc_session = self.plugin.session_factory()
         except requests.exceptions.ConnectionError:
             time.sleep(2)
             try:
-                self.wc_session = sa_gwdata.WaterConnectSession()
+                self.wc_session = self.plugin.session_factory()
             except:
                 self.exception = Exception(traceback.format_exc().splitlines()[-1])
                 return False
         return True
 
+    def cached_observations(self, service, dh_nos):
+        """Return the data for some wells which is in the plugin's
+        observation cache, and note the wells which must be downloaded in
+        ``self.download_dh_nos``.
+
+        Args:
+            service (str): name of API endpoint on Groundwater Data
+            dh_nos (list): drillhole numbers
+
+        Returns: pandas.DataFrame
+
+        """
+        cache = self.plugin.obs_cache
+        cached = cache.dh_nos(service)
+        self.download_service = service
+        self.download_dh_nos = [x for x in dh_nos if not x in cached]
+        self.downloaded_df = None
+        return cache.get(service, [x for x in dh_nos if x in cached])
+
+    def fetch_observations(self, service, dh_nos):
+        """Get bulk download data for some wells, using the plugin's
+        observation cache where possible. Call from ``self.run()``.
+
+        Args:
+            service (str): name of API endpoint on Groundwater Data
+            dh_nos (list): drillhole numbers
+
+        Returns: pandas.DataFrame
+
+        Any data which had to be downloaded is added to the cache.
+
+        """
+        frames = [self.cached_observations(service, dh_nos)]
+        if self.download_dh_nos:
+            if not self.get_waterconnect_session():
+                raise self.exception
+            self.downloaded_df = self.wc_session.bulk_download(
+                service, {"DHNOs": self.download_dh_nos}
+            )
+            frames.append(self.downloaded_df)
+            self.cache_observations()
+        return pd.concat(frames, ignore_index=True, sort=False)
+
+    async def fetch_observations_async(self, service, dh_nos):
+        """Coroutine which does the same as ``self.fetch_observations()``
+        using ``self.engine``. Call from ``self.run_async()``."""
+        frames = [await self.run_in_thread(self.cached_observations, service, dh_nos)]
+        if self.download_dh_nos:
+            self.downloaded_df = await bulk_download(
+                self.engine, service, self.download_dh_nos
+            )
+            frames.append(self.downloaded_df)
+            await self.run_in_thread(self.cache_observations)
+        return pd.concat(frames, ignore_index=True, sort=False)
+
+    async def run_in_thread(self, func, *args):
+        """Coroutine which calls ``func(*args)`` in a thread of the event
+        loop's default executor, so that processing data does not hold up
+        the event loop."""
+        return await asyncio.get_running_loop().run_in_executor(None, func, *args)
+
+    def cache_observations(self):
+        """Add data downloaded by ``self.fetch_observations()`` to the
+        plugin's observation cache. Called from the task's thread; data
+        which cannot be cached is logged and left out, since the task can
+        carry on without it."""
+        if self.downloaded_df is None:
+            return
+        try:
+            self.plugin.obs_cache.add(
+                self.download_service, self.downloaded_df, self.download_dh_nos
+            )
+        except:
+            self.log(
+                "Could not cache data from {}: {}".format(
+                    self.download_service, traceback.format_exc()
+                ),
+                level=Qgis.Warning,
+            )
+
     def finished_success(self):
         """This method should be implemented by child classes. It is 
         called from the main thread in the case that the task's execution
@@ -101,6 +321,48 @@ class Task(QgsTask):
         super().cancel()
 
 
+class EngineTaskRunner(QObject):
+    '''Runs the ``run_async()`` coroutines of tasks on their request
+    engine, so that no QGIS task manager thread waits on the requests.
+    When a coroutine is done, the task's ``finished()`` method is called
+    from the main thread, as the task manager would.
+
+    The tasks are not added to the task manager, so they have no progress
+    bar and cannot be cancelled by the user. They only stop early if the
+    request engine is shut down, which cancels them.
+
+    Must be created in the main thread.
+
+    '''
+    task_done = pyqtSignal(object, object)
+
+    def __init__(self):
+        super().__init__()
+        self.tasks = set()
+        self.task_done.connect(self.finish)
+
+    def start(self, task):
+        '''Start running a task on ``task.engine``.'''
+        self.tasks.add(task)
+        future = task.engine.submit(task.run_async())
+        # Emitted from the event loop thread, so the signal is queued to
+        # the main thread.
+        future.add_done_callback(lambda future: self.task_done.emit(task, future))
+
+    def finish(self, task, future):
+        self.tasks.discard(task)
+        if future.cancelled():
+            # The request engine was shut down.
+            task.finished(False)
+            return
+        try:
+            result = future.result()
+        except:
+            task.exception = Exception(traceback.format_exc())
+            result = False
+        task.finished(result)
+
+
 class FindMapCanvasWellsTask(Task):
     '''Load wells in the extent of the map canvas, and update
     the plugin's designated "wells" layer with the results.
@@ -134,162 +396,210 @@ class FindMapCanvasWellsTask(Task):
         '''
         self.log('Started task "{}"'.format(self.description()))
 
-        def get_wells(rects):
+        def get_wells(rects, depth=0):
             all_wells = []
             for lats, lons in rects:
                 self.log("Fetching wells from: lats={}, lons={}".format(lats, lons))
                 wells = self.wc_session.find_wells_in_lat_lon(lats=lats, lons=lons)
                 self.log("Found {} wells".format(len(wells)))
-                if len(wells) == 10000:
+                if len(wells) >= self.plugin.row_cap and depth >= MAX_SUBDIVISIONS:
+                    self.log(
+                        "Too many wells in a small area; results for "
+                        "lats={}, lons={} are truncated".format(lats, lons),
+                        level=Qgis.Warning,
+                    )
+                elif len(wells) >= self.plugin.row_cap:
                     self.log("Subdividing rectangle and starting again")
-                    wells = get_wells(subdivide_rect(lats, lons))
+                    wells = get_wells(subdivide_rect(lats, lons), depth + 1)
                 all_wells += wells
-            return sa_gwdata.Wells(all_wells)
+            return all_wells
 
         if not self.get_waterconnect_session():
             return False
 
         try:
-            lats = self.lats
-            lons = self.lons
-            wells = get_wells([[lats, lons]])
-            wells_df = wells.df()
-            for col in WELL_COLUMNS:
-                if not col in wells_df:
-                    wells_df[col] = ""
-            for datecol in WELL_DATE_COLUMNS:
-                wells_df[datecol] = pd.to_datetime(
-                    wells_df[datecol], format=r"%Y-%m-%d"
-                )
-                wells_df[datecol + "_year"] = wells_df[datecol].dt.year
-            self.log(str([x for x in wells_df.columns]))
-            wells_df["well_id"] = wells_df.apply(
-                lambda x: apply_well_id(x, ("obs_no.id", "unit_no.hyphen")),
-                axis="columns",
-            )
-            for col in wells_df.columns:
-                dtype = wells_df[col].dtype.name
-                if dtype[0].upper() in ("O", "S"):
-                    wells_df.loc[pd.isnull(wells_df[col]), col] = ""
+            wells = get_wells([[self.lats, self.lons]])
+            self.wells_df = self.process_wells(wells)
         except:
             self.exception = Exception(traceback.format_exc())
             return False
-        self.wells_df = wells_df
         return True
 
+    async def run_async(self):
+        '''Coroutine which does the same as ``self.run()`` with the
+        request engine, fetching the parts of a subdivided rectangle
+        concurrently.'''
+        self.log('Started task "{}"'.format(self.description()))
+        wells = await find_wells(
+            self.engine, self.lats, self.lons, self.plugin.row_cap, self
+        )
+        self.wells_df = await self.run_in_thread(self.process_wells, wells)
+        return True
+
+    def process_wells(self, wells):
+        '''Convert wells returned by ``find_wells_in_lat_lon`` to the
+        pandas DataFrame used for the wells layer.'''
+        wells_df = wells_to_df(wells)
+        for col in WELL_COLUMNS:
+            if not col in wells_df:
+                wells_df[col] = ""
+        for datecol in WELL_DATE_COLUMNS:
+            wells_df[datecol] = pd.to_datetime(wells_df[datecol], format=r"%Y-%m-%d")
+            wells_df[datecol + "_year"] = wells_df[datecol].dt.year
+        self.log(str([x for x in wells_df.columns]))
+        wells_df["well_id"] = wells_df.apply(
+            lambda x: apply_well_id(x, ("obs_no.id", "unit_no.hyphen")),
+            axis="columns",
+        )
+        for col in wells_df.columns:
+            dtype = wells_df[col].dtype.name
+            if dtype[0].upper() in ("O", "S"):
+                wells_df.loc[pd.isnull(wells_df[col]), col] = ""
+        return wells_df
+
     def finished_success(self):
         '''On completion, convert the downloaded pandas DataFrame
         to the plugin's "wells" QgsVectorLayer.
 
         '''
         self.log("{} wells found".format(len(self.wells_df)))
-
-        wells_layer_existed = self.plugin.wells_layer != None
-        self.plugin.wells_layer = df_to_vector_layer(
-            self.wells_df, vlayer=self.plugin.wells_layer, name="sa_gwdata wells"
-        )
-        if not wells_layer_existed:
-            self.plugin.wells_layer.destroyed.connect(self.plugin.wells_layer_removed)
-        if not self.plugin.wells_layer in self.plugin.iface.mapCanvas().layers():
-            self.plugin.wells_layer.loadNamedStyle(
-                os.path.join(
-                    os.path.dirname(os.path.abspath(__file__)), "well_id_labels.qml"
-                )
-            )
-            QgsProject.instance().addMapLayer(self.plugin.wells_layer)
+        self.plugin.add_wells_df(self.wells_df)
 
 
 class ParamTimeSeriesPlotTask(Task):
     '''Abstract task class for downloading a time series of parameter
     data from Groundwater Data and making a chart with a temporary
-    vector layer highlighting the wells charted.
+    virtual layer highlighting the wells charted. The layer is a view
+    of the plugin's wells layer and is removed when the chart is closed.
+
+    Child classes set the class attributes ``bulk_download_service``
+    (name of API endpoint on Groundwater Data e.g. "GetWaterLevelDownload")
+    and ``datecol`` (name of column with observation dates), and implement
+    ``plot_well()``.
 
     Args:
         plugin (SAGwDataPlugin object): the plugin object
-        bulk_download_service (str): name of API endpoint on Groundwater Data
-            e.g. "GetWaterLevelDownload"
-        datecol (str): name of column with observation dates.
         paramcol (str): name of column with data
         ylabel (str): y-axis label for chart
 
     '''
-    def __init__(self, plugin, bulk_download_service, datecol, paramcol, ylabel):
+    bulk_download_service = None
+    datecol = None
+
+    def __init__(self, plugin, paramcol, ylabel):
         super().__init__(plugin)
         layer = plugin.iface.activeLayer()
         fields = layer.fields().names()
         self.dh_nos = []
+        self.aq_mons = {}
         for feature in layer.selectedFeatures():
             vals = dict(zip(fields, feature.attributes()))
             self.dh_nos.append(vals["dh_no"])
-        self.bulk_download_service = bulk_download_service
-        self.datecol = datecol
+            if vals.get("aq_mon", NULL) != NULL:
+                self.aq_mons[vals["well_id"]] = vals["aq_mon"]
         self.paramcol = paramcol
         self.ylabel = ylabel
-        self.all_wells_df = self.plugin.wells_layer_df()
+
+    @classmethod
+    def plot_well(cls, ax, wdf, paramcol, label, colour):
+        '''Plot the data for one well. This method should be implemented
+        by child classes; here it plots nothing.
+
+        Args:
+            ax (matplotlib Axes): where to plot
+            wdf (pandas.DataFrame): data for the well
+            paramcol (str): name of column with data
+            label (str): legend label for the well
+            colour: matplotlib colour for the well
+
+        Returns: list of the matplotlib artists created.
+
+        '''
+        return []
+
+    @classmethod
+    def plot_legend_extras(cls, ax, df):
+        '''Plot any extra (empty) artists needed to explain the chart in
+        its legend. Returns: list of the matplotlib artists created.'''
+        return []
+
+    @classmethod
+    def setup_axes(cls, ax, paramcol, ylabel):
+        ax.set_ylabel(ylabel)
 
     def run(self):
-        '''Download data as DataFrame as background task.'''
-        if not self.get_waterconnect_session():
-            return False
+        '''Download data as DataFrame as background task. Data already
+        in the plugin's observation cache is not downloaded again.'''
         try:
-            df = self.wc_session.bulk_download(
-                self.bulk_download_service, {"DHNOs": self.dh_nos}
-            )
-            self.log("Param Plot task: columns = {}".format(str(df.columns.values)))
-            df[self.datecol] = pd.to_datetime(df[self.datecol], format=r"%d/%m/%Y")
-            df = df.dropna(subset=[self.datecol, self.paramcol], how="any")
-            df["well_id"] = df.apply(apply_well_id, axis="columns")
-            self.df = df
-            well_ids = list(df["well_id"].unique())
-            self.log("well_ids 265. : {}".format(str(well_ids)))
-            self.well_ids = sorted([x for x in well_ids if isinstance(x, str)])
-            self.log("self.well_ids 267. : {}".format(str(self.well_ids)))
-            if len(self.df) == 0:
-                self.log("No data points were found!!")
-                return False
-            self.colours = sns.color_palette("bright", len(self.well_ids))
+            df = self.fetch_observations(self.bulk_download_service, self.dh_nos)
+            return self.process_observations(df)
         except:
             self.exception = Exception(traceback.format_exc())
             return False
 
+    async def run_async(self):
+        '''Coroutine which does the same as ``self.run()`` with the
+        request engine.'''
+        df = await self.fetch_observations_async(
+            self.bulk_download_service, self.dh_nos
+        )
+        return await self.run_in_thread(self.process_observations, df)
+
+    def process_observations(self, df):
+        '''Prepare the downloaded data for charting and choose the colours
+        of the wells. Returns False if there is nothing to chart.'''
+        if len(df) == 0:
+            self.log("No data points were found!!")
+            return False
+        self.log("Param Plot task: columns = {}".format(str(df.columns.values)))
+        df = prepare_observations(df, self.datecol, self.paramcol)
+        self.df = df
+        well_ids = list(df["well_id"].unique())
+        self.log("well_ids 265. : {}".format(str(well_ids)))
+        self.well_ids = sorted([x for x in well_ids if isinstance(x, str)])
+        self.log("self.well_ids 267. : {}".format(str(self.well_ids)))
+        if len(self.df) == 0:
+            self.log("No data points were found!!")
+            return False
+        self.styles = well_styles(
+            self.well_ids,
+            sns.color_palette("bright", len(self.well_ids)),
+            self.aq_mons,
+        )
         return True
 
     def finished_success(self):
-        '''When finished, create a temporary vector layer for wells, with each point
-        colour-coded as they are on the chart itself.'''
-        dh_nos = self.df.DHNO.unique()
-        df = self.all_wells_df[self.all_wells_df.dh_no.isin(dh_nos)]
-        layer = df_to_vector_layer(
-            df, name="Fig {:.0f} {}".format(self.fignum, self.paramcol)
+        '''Draw the chart figure and make it appear, with a temporary
+        virtual layer for the wells, with each point colour-coded as they
+        are on the chart itself.'''
+        self.log(
+            "Found {} values from {}".format(len(self.df), self.bulk_download_service)
         )
+        self.log(str([x for x in self.df.columns]))
+        fig = plt.figure()
+        ax = fig.add_subplot(111)
+        groups = self.df.groupby("well_id")
+        for well_id, colour, label in zip(
+            self.styles.index, self.styles.colour, self.styles.label
+        ):
+            self.plot_well(ax, groups.get_group(well_id), self.paramcol, label, colour)
+        self.plot_legend_extras(ax, self.df)
+        self.setup_axes(ax, self.paramcol, self.ylabel)
+        ax.legend(loc="best", frameon=False, fontsize="small")
+        fig.tight_layout()
+        self.fignum = fig.number
 
-        # A colour category for each feature.
-        categories = []
-        for i, well_id in enumerate(self.well_ids):
-            symbol = QgsSymbol.defaultSymbol(layer.geometryType())
-            self.log("well_id {} id(symbol) {}".format(well_id, id(symbol)))
-            colour = self.colours[i]
-            colour_256 = [x * 255 for x in colour]
-            qcolor = QColor(*colour_256)
-            self.log(
-                "well_id {} colour {} colour_256 {} qcolor {}".format(
-                    well_id, colour, colour_256, qcolor
-                )
-            )
-            for symbol_layer in symbol.symbolLayers():
-                symbol_layer.setFillColor(qcolor)
-            label = well_id
-            aq_mon = self.all_wells_df[lambda x: x.well_id == well_id].aq_mon.iloc[0]
-            if not pd.isnull(aq_mon):
-                label += " {}".format(aq_mon)
-            category = QgsRendererCategory(well_id, symbol, label)
-            categories.append(category)
-        renderer = QgsCategorizedSymbolRenderer("well_id", categories)
-        layer.setRenderer(renderer)
-        QgsProject.instance().addMapLayer(layer)
+        layer = highlight_layer(
+            self.plugin.wells_layer,
+            self.df.DHNO.unique(),
+            name="Fig {:.0f} {}".format(self.fignum, self.paramcol),
+        )
+        layer.setRenderer(well_id_renderer(layer.geometryType(), self.styles))
+        self.plugin.set_figure_layer(self.fignum, layer)
         layer.triggerRepaint()
         self.plugin.iface.layerTreeView().refreshLayerSymbology(layer.id())
         self.plugin.iface.setActiveLayer(self.plugin.wells_layer)
+        fig.show()
 
 
 class WaterLevelPlotTask(ParamTimeSeriesPlotTask):
@@ -300,114 +610,216 @@ class WaterLevelPlotTask(ParamTimeSeriesPlotTask):
         ylabel (str): y-axis label
 
     '''
-    def __init__(self, plugin, paramcol, ylabel):
-        super().__init__(
-            plugin,
-            bulk_download_service="GetWaterLevelDownload",
-            datecol="obs_date",
-            paramcol=paramcol,
-            ylabel=ylabel,
+    bulk_download_service = "GetWaterLevelDownload"
+    datecol = "obs_date"
+
+    @classmethod
+    def plot_well(cls, ax, wdf, paramcol, label, colour):
+        wdf = wdf.sort_values(cls.datecol)
+        return ax.plot(
+            wdf[cls.datecol],
+            wdf[paramcol],
+            label=label,
+            color=colour,
+            lw=1,
+            marker=".",
+            ms=5,
         )
 
-    def finished_success(self):
-        '''Draw the chart figure and make it appear.'''
-        self.log(
-            "Found {} values from {}".format(len(self.df), self.bulk_download_service)
-        )
-        self.log(str([x for x in self.df.columns]))
-        fig = plt.figure()
-        ax = fig.add_subplot(111)
-        for i, well_id in enumerate(self.well_ids):
-            wdf = self.df[self.df["well_id"] == well_id]
-            label = well_id
-            aq_mon = self.all_wells_df[lambda x: x.well_id == well_id].aq_mon.iloc[0]
-            if not pd.isnull(aq_mon):
-                label += " {}".format(aq_mon)
-            if len(wdf):
-                wdf = wdf.sort_values(self.datecol)
-                ax.plot(
-                    wdf[self.datecol],
-                    wdf[self.paramcol],
-                    label=label,
-                    color=self.colours[i],
-                    lw=1,
-                    marker=".",
-                    ms=5,
-                )
-        ax.set_ylabel(self.ylabel)
-        if self.paramcol == "swl":
+    @classmethod
+    def setup_axes(cls, ax, paramcol, ylabel):
+        ax.set_ylabel(ylabel)
+        if paramcol == "swl":
             ax.invert_yaxis()
-        ax.legend(loc="best", frameon=False, fontsize="small")
-        fig.tight_layout()
-        self.fignum = fig.number
-        super().finished_success()
-        fig.show()
 
 
 class SalinityPlotTask(ParamTimeSeriesPlotTask):
-    '''Create salinity chart.
+    '''Create salinity chart. Separate lines will appear for bailed and
+    pumped samples. Other data are shown as points only.
 
     Args:
         paramcol (str): either "TDS" or "EC"
         ylabel (str): y-axis label
 
     '''
-    def __init__(self, plugin, paramcol, ylabel):
-        super().__init__(
-            plugin,
-            bulk_download_service="GetSalinityDownload",
-            datecol="Collected_date",
-            paramcol=paramcol,
-            ylabel=ylabel,
-        )
-
-    def finished_success(self):
-        '''Draw the chart figure and make it appear. Separate lines
-        will appear for bailed and pumped samples. Other data are shown
-        as points only.
-        
-        '''
-        self.log(
-            "Found {} values from {}".format(len(self.df), self.bulk_download_service)
-        )
-        self.log(str([x for x in self.df.columns]))
-        fig = plt.figure()
-        ax = fig.add_subplot(111)
-
-        self.df.loc[self.df.extract_method.isnull(), "extract_method"] = "UKN"
-        for i, well_id in enumerate(self.well_ids):
-            wdf = self.df[self.df["well_id"] == well_id]
-            if len(wdf):
-                wdf = wdf.sort_values(["extract_method", self.datecol])
-                for j, (extract_method, edf) in enumerate(
-                    wdf.groupby("extract_method")
-                ):
-                    edf = edf.sort_values(self.datecol)
-                    ax.plot(
-                        edf[self.datecol],
-                        edf[self.paramcol],
-                        color=self.colours[i],
-                        label="",
-                        **EXTRACT_METHOD_KWS[extract_method]
-                    )
-                label = well_id
-                aq_mon = self.all_wells_df[lambda x: x.well_id == well_id].aq_mon.iloc[
-                    0
-                ]
-                if not pd.isnull(aq_mon):
-                    label += " {}".format(aq_mon)
-                ax.plot([], [], color=self.colours[i], lw=3, label=label)
-        for extract_method in self.df["extract_method"].unique():
-            ax.plot(
+    bulk_download_service = "GetSalinityDownload"
+    datecol = "Collected_date"
+
+    @classmethod
+    def plot_well(cls, ax, wdf, paramcol, label, colour):
+        artists = []
+        wdf = wdf.assign(extract_method=wdf.extract_method.fillna("UKN"))
+        wdf = wdf.sort_values(["extract_method", cls.datecol])
+        for extract_method, edf in wdf.groupby("extract_method"):
+            edf = edf.sort_values(cls.datecol)
+            artists += ax.plot(
+                edf[cls.datecol],
+                edf[paramcol],
+                color=colour,
+                label="",
+                **EXTRACT_METHOD_KWS[extract_method]
+            )
+        artists += ax.plot([], [], color=colour, lw=3, label=label)
+        return artists
+
+    @classmethod
+    def plot_legend_extras(cls, ax, df):
+        artists = []
+        for extract_method in df["extract_method"].fillna("UKN").unique():
+            artists += ax.plot(
                 [],
                 [],
                 color="k",
                 **EXTRACT_METHOD_KWS[extract_method],
                 label=extract_method
             )
-        ax.set_ylabel(self.ylabel)
-        ax.legend(loc="best", frameon=False, fontsize="small")
-        fig.tight_layout()
-        self.fignum = fig.number
-        super().finished_success()
-        fig.show()
+        return artists
+
+
+class FetchObservationsTask(Task):
+    '''Get bulk download data for some wells, using the plugin's
+    observation cache where possible, and pass it to a callback.
+
+    Args:
+        plugin (SAGwDataPlugin object): the plugin object
+        service (str): name of API endpoint on Groundwater Data
+        dh_nos (list): drillhole numbers
+        callback (callable): called from the main thread with the list
+            of drillhole numbers and the data as a pandas.DataFrame, or
+            None if the task failed.
+
+    '''
+    def __init__(self, plugin, service, dh_nos, callback):
+        super().__init__(plugin)
+        self.service = service
+        self.dh_nos = dh_nos
+        self.callback = callback
+
+    def run(self):
+        '''Download data as DataFrame as background task.'''
+        try:
+            self.df = self.fetch_observations(self.service, self.dh_nos)
+        except:
+            self.exception = Exception(traceback.format_exc())
+            return False
+        return True
+
+    async def run_async(self):
+        '''Coroutine which does the same as ``self.run()`` with the
+        request engine.'''
+        self.df = await self.fetch_observations_async(self.service, self.dh_nos)
+        return True
+
+    def finished(self, result):
+        if not result:
+            self.callback(self.dh_nos, None)
+        super().finished(result)
+
+    def finished_success(self):
+        self.callback(self.dh_nos, self.df)
+
+
+class ExportSnapshotTask(Task):
+    '''Save the plugin's wells and cached observation data to a snapshot
+    file.
+
+    Args:
+        plugin (SAGwDataPlugin object): the plugin object
+        filename (str): path of the snapshot file
+
+    '''
+    def __init__(self, plugin, filename):
+        super().__init__(plugin)
+        self.filename = filename
+        self.source = QgsVectorLayerFeatureSource(plugin.wells_layer)
+        self.names = plugin.wells_layer.fields().names()
+
+    def run(self):
+        '''Write the snapshot as background task.'''
+        try:
+            wells_df = features_to_df(self.source.getFeatures(), self.names)
+            write_snapshot(self.filename, wells_df, self.plugin.obs_cache)
+        except:
+            self.exception = Exception(traceback.format_exc())
+            return False
+        return True
+
+    def finished_success(self):
+        self.plugin.iface.messageBar().pushMessage(
+            "SA Groundwater Data",
+            "Snapshot saved to {}".format(self.filename),
+            level=Qgis.Success,
+        )
+
+
+class ImportSnapshotTask(Task):
+    '''Load wells and observation data from a snapshot file into the
+    plugin's wells layer and observation cache.
+
+    Args:
+        plugin (SAGwDataPlugin object): the plugin object
+        filename (str): path of the snapshot file
+
+    '''
+    def __init__(self, plugin, filename):
+        super().__init__(plugin)
+        self.filename = filename
+
+    def run(self):
+        '''Read the snapshot as background task.'''
+        try:
+            self.obs_cache = ObservationCache()
+            self.wells_df = read_snapshot(self.filename, self.obs_cache)
+        except:
+            self.exception = Exception(traceback.format_exc())
+            return False
+        return True
+
+    def finished_success(self):
+        '''Add the wells to the wells layer and the observation data to
+        the plugin's cache.'''
+        self.plugin.obs_cache.update(self.obs_cache)
+        self.plugin.add_wells_df(self.wells_df)
+        self.plugin.iface.messageBar().pushMessage(
+            "SA Groundwater Data",
+            "{} wells loaded from {}".format(len(self.wells_df), self.filename),
+            level=Qgis.Success,
+        )
+
+
+class LoadTestTask(Task):
+    '''Run the fetch pipeline against a local replay of recorded
+    WaterConnect responses at several levels of concurrency, and log a
+    report of throughput, latency and peak memory.
+
+    Args:
+        plugin (SAGwDataPlugin object): the plugin object
+        filename (str): fixture file saved while recording responses
+        **kwargs: passed to ``replay.run_load_test``
+
+    '''
+    def __init__(self, plugin, filename, **kwargs):
+        super().__init__(plugin)
+        self.filename = filename
+        self.kwargs = kwargs
+
+    def run(self):
+        '''Run the load test as background task.'''
+        from .replay import run_load_test
+
+        try:
+            self.report = run_load_test(self.filename, log=self.log, **self.kwargs)
+        except:
+            self.exception = Exception(traceback.format_exc())
+            return False
+        return True
+
+    def finished_success(self):
+        '''Write the report to the log.'''
+        with pd.option_context("display.width", 250, "display.max_columns", 20):
+            self.log("Load test report:\n{}".format(self.report.round(3)))
+        self.plugin.iface.messageBar().pushMessage(
+            "SA Groundwater Data",
+            "Load test finished; see the LoadTestTask log for the report.",
+            level=Qgis.Success,
+        )
@@ -0,0 +1,319 @@
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlparse
+import json
+import math
+import random
+import threading
+import time
+import tracemalloc
+
+from .install_dependencies import *
+
+import requests
+import pandas as pd
+
+from .plugin_tasks import *
+from .request_engine import *
+from .snapshot import *
+from .utils import *
+
+
+class FixtureRecorder:
+    """Collects WaterConnect responses made through RecordingSession
+    objects, so they can be saved as a fixture file for ReplayServer.
+
+    Fixture files are snapshot files (see snapshot.py) holding the raw
+    wells and bulk download data, before the plugin tasks process them.
+
+    """
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.wells_frames = []
+        self.obs_cache = ObservationCache()
+
+    def add_wells(self, wells_df):
+        with self.lock:
+            self.wells_frames.append(wells_df)
+
+    def add_observations(self, service, df, dh_nos):
+        with self.lock:
+            self.obs_cache.add(service, df, dh_nos)
+
+    def save(self, filename):
+        """Write the responses recorded so far to a fixture file."""
+        with self.lock:
+            if self.wells_frames:
+                wells_df = pd.concat(self.wells_frames, ignore_index=True, sort=False)
+                wells_df = wells_df.drop_duplicates(subset="dh_no")
+            else:
+                wells_df = pd.DataFrame(columns=["dh_no", "lat", "lon"])
+            write_snapshot(filename, wells_df, self.obs_cache)
+
+
+class RecordingSession:
+    """Wraps a WaterConnectSession, passing the responses of
+    ``find_wells_in_lat_lon`` and ``bulk_download`` to a FixtureRecorder.
+
+    Args:
+        session (WaterConnectSession): the session to wrap
+        recorder (FixtureRecorder): where responses are recorded
+
+    """
+
+    def __init__(self, session, recorder):
+        self.session = session
+        self.recorder = recorder
+
+    def find_wells_in_lat_lon(self, lats, lons):
+        wells = self.session.find_wells_in_lat_lon(lats=lats, lons=lons)
+        self.recorder.add_wells(wells_to_df(wells))
+        return wells
+
+    def bulk_download(self, service, params):
+        df = self.session.bulk_download(service, params)
+        self.recorder.add_observations(service, df, params["DHNOs"])
+        return df
+
+    def __getattr__(self, name):
+        return getattr(self.session, name)
+
+
+class ReplayServer:
+    """Local HTTP server which stands in for WaterConnect, serving the
+    responses in a fixture file.
+
+    Args:
+        filename (str): fixture file saved by FixtureRecorder
+        latency (float): seconds added to every response
+        jitter (float): up to this many extra seconds are added at random
+        error_rate (float): fraction of requests which fail with HTTP 503
+        row_cap (int): maximum number of wells returned per request, as
+            for the real service.
+
+    Wells are returned for any rectangle, not just the ones recorded, so
+    the server can be used to see how the plugin behaves with other
+    extents and row caps. The server runs in a daemon thread until
+    ``shutdown()`` is called.
+
+    """
+
+    def __init__(
+        self,
+        filename,
+        latency=0.2,
+        jitter=0.1,
+        error_rate=0,
+        row_cap=WATERCONNECT_ROW_CAP,
+    ):
+        self.latency = latency
+        self.jitter = jitter
+        self.error_rate = error_rate
+        self.row_cap = row_cap
+        self.obs_cache = ObservationCache()
+        self.obs_lock = threading.Lock()
+        self.wells_df = read_snapshot(filename, self.obs_cache)
+        self.httpd = ThreadingHTTPServer(("127.0.0.1", 0), self.handler_class())
+        self.httpd.daemon_threads = True
+        self.url = "http://127.0.0.1:{}".format(self.httpd.server_address[1])
+        self.thread = threading.Thread(
+            target=self.httpd.serve_forever, name="sa_gwdata replay server", daemon=True
+        )
+        self.thread.start()
+
+    def find_wells(self, lats, lons):
+        df = self.wells_df
+        df = df[
+            (df.lat >= min(lats))
+            & (df.lat <= max(lats))
+            & (df.lon >= min(lons))
+            & (df.lon <= max(lons))
+        ]
+        return df.head(self.row_cap)
+
+    def bulk_download(self, service, dh_nos):
+        with self.obs_lock:
+            return self.obs_cache.get(service, dh_nos)
+
+    def handler_class(self):
+        server = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_GET(self):
+                url = urlparse(self.path)
+                query = parse_qs(url.query)
+                if url.path != "/wells":
+                    return self.send_error(404)
+                lats = [float(x) for x in query["lat"]]
+                lons = [float(x) for x in query["lon"]]
+                self.respond(lambda: server.find_wells(lats, lons))
+
+            def do_POST(self):
+                url = urlparse(self.path)
+                if not url.path.startswith("/bulk/"):
+                    return self.send_error(404)
+                service = url.path[len("/bulk/") :]
+                length = int(self.headers["Content-Length"])
+                params = json.loads(self.rfile.read(length).decode("utf-8"))
+                self.respond(lambda: server.bulk_download(service, params["DHNOs"]))
+
+            def respond(self, get_df):
+                time.sleep(server.latency + random.uniform(0, server.jitter))
+                if random.random() < server.error_rate:
+                    return self.send_error(503)
+                body = get_df().to_json(orient="records").encode("utf-8")
+                self.send_response(200)
+                self.send_header("Content-Type", "application/json")
+                self.send_header("Content-Length", str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, format, *args):
+                pass
+
+        return Handler
+
+    def shutdown(self):
+        self.httpd.shutdown()
+        self.httpd.server_close()
+
+
+class ReplaySession:
+    """Stands in for WaterConnectSession, making requests to a
+    ReplayServer.
+
+    Args:
+        url (str): the ReplayServer's URL
+        timings (list): optional. A ``(seconds, ok)`` tuple is appended
+            for every request made.
+        ignore_errors (bool): if True, a failed request returns no wells
+            or data instead of raising an exception, so that one failure
+            does not stop the other requests in a load test.
+
+    """
+
+    def __init__(self, url, timings=None, ignore_errors=False):
+        self.url = url
+        self.timings = timings
+        self.ignore_errors = ignore_errors
+        self.session = requests.Session()
+
+    def request(self, method, path, **kwargs):
+        start = time.perf_counter()
+        ok = False
+        try:
+            response = self.session.request(method, self.url + path, **kwargs)
+            response.raise_for_status()
+            ok = True
+        except requests.exceptions.RequestException:
+            if not self.ignore_errors:
+                raise
+            return []
+        finally:
+            if self.timings is not None:
+                self.timings.append((time.perf_counter() - start, ok))
+        return response.json()
+
+    def find_wells_in_lat_lon(self, lats, lons):
+        return self.request("GET", "/wells", params={"lat": lats, "lon": lons})
+
+    def bulk_download(self, service, params):
+        return pd.DataFrame(
+            self.request("POST", "/bulk/" + service, json={"DHNOs": params["DHNOs"]})
+        )
+
+
+def percentile(values, q):
+    """Return the q-th percentile (0 to 100) of a list of numbers, by the
+    nearest-rank method."""
+    values = sorted(values)
+    if not values:
+        return float("nan")
+    rank = max(math.ceil(q / 100 * len(values)), 1)
+    return values[rank - 1]
+
+
+def run_load_test(
+    filename,
+    concurrency_levels=(1, 2, 4, 8, 16),
+    latency=0.2,
+    jitter=0.1,
+    error_rate=0,
+    row_cap=WATERCONNECT_ROW_CAP,
+    timeout=120,
+    log=print,
+):
+    """Run the plugin's fetch pipeline against a ReplayServer at several
+    levels of concurrency.
+
+    Args:
+        filename (str): fixture file saved by FixtureRecorder
+        concurrency_levels (iterable): values of ``max_per_host`` for the
+            RequestEngine.
+        latency, jitter, error_rate, row_cap: see ReplayServer
+        timeout (float): request timeout for the RequestEngine
+        log (callable): called with progress messages
+
+    For each level, all the wells in the fixture's extent are found, then
+    all the recorded observation data is bulk downloaded. Failed requests
+    are counted in "failed_requests" and the rest of the level carries
+    on; "rows" only counts the rows which were returned.
+
+    Only the requests are measured: the processing done by the plugin
+    tasks afterwards (e.g. converting the wells to a layer) is not.
+
+    Returns: pandas.DataFrame with one row per concurrency level. Peak
+    memory is measured with tracemalloc and so includes the server, which
+    runs in the same process.
+
+    """
+    server = ReplayServer(filename, latency, jitter, error_rate, row_cap)
+    try:
+        wells_df = server.wells_df
+        lats = [wells_df.lat.min(), wells_df.lat.max()]
+        lons = [wells_df.lon.min(), wells_df.lon.max()]
+        results = []
+        for concurrency in concurrency_levels:
+            log("Load test with {} concurrent requests".format(concurrency))
+            timings = []
+            engine = RequestEngine(
+                lambda: ReplaySession(server.url, timings, ignore_errors=True),
+                max_per_host=concurrency,
+                timeout=timeout,
+            )
+            error = ""
+            rows = 0
+            tracemalloc.start()
+            start = time.perf_counter()
+            try:
+                wells = engine.run(find_wells(engine, lats, lons, row_cap))
+                rows += len(wells)
+                for service in server.obs_cache.services():
+                    dh_nos = sorted(server.obs_cache.dh_nos(service))
+                    rows += len(engine.run(bulk_download(engine, service, dh_nos)))
+            except Exception as e:
+                error = repr(e)
+            seconds = time.perf_counter() - start
+            peak_memory = tracemalloc.get_traced_memory()[1]
+            tracemalloc.stop()
+            engine.shutdown()
+            durations = [t for t, ok in timings]
+            results.append(
+                {
+                    "concurrency": concurrency,
+                    "requests": len(timings),
+                    "failed_requests": len([ok for t, ok in timings if not ok]),
+                    "rows": rows,
+                    "seconds": seconds,
+                    "requests_per_second": len(timings) / seconds,
+                    "rows_per_second": rows / seconds,
+                    "p50_latency": percentile(durations, 50),
+                    "p95_latency": percentile(durations, 95),
+                    "p99_latency": percentile(durations, 99),
+                    "peak_memory_mb": peak_memory / 1e6,
+                    "error": error,
+                }
+            )
+    finally:
+        server.shutdown()
+    return pd.DataFrame(results)
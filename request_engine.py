@@ -0,0 +1,147 @@
+import asyncio
+import concurrent.futures
+import functools
+import threading
+
+
+class RequestEngine:
+    """Runs WaterConnect requests concurrently from a single event loop.
+
+    Args:
+        session_factory (callable): returns a new session object, e.g.
+            ``sa_gwdata.WaterConnectSession``. Each worker thread gets
+            its own session.
+        max_per_host (int): maximum number of requests in flight to any
+            one host at a time. Further requests wait their turn.
+        timeout (float): seconds to wait for a request before giving up
+            on it with ``asyncio.TimeoutError``. The request itself runs
+            on in its worker thread until the session gives up.
+
+    The event loop runs in one daemon thread owned by the engine. The
+    session calls themselves are blocking, so they are handed to a small
+    thread pool sized by the per-host limits; any number of requests can
+    be queued up without using threads from the QGIS task manager.
+
+    Coroutines built with ``call()`` are started from other threads with
+    ``submit()``, for example::
+
+        future = engine.submit(
+            engine.call(
+                WATERCONNECT_HOST,
+                lambda session: session.find_wells_in_lat_lon(lats=lats, lons=lons),
+            )
+        )
+        future.add_done_callback(...)
+
+    ``run()`` waits for the result instead, which ties up the calling
+    thread, so it is only for scripts such as the load test.
+
+    """
+
+    def __init__(self, session_factory, max_per_host=4, timeout=120):
+        self.session_factory = session_factory
+        self.max_per_host = max_per_host
+        self.timeout = timeout
+        self.semaphores = {}
+        self.local = threading.local()
+        self.executor = concurrent.futures.ThreadPoolExecutor(
+            max_workers=max_per_host, thread_name_prefix="sa_gwdata"
+        )
+        self.loop = asyncio.new_event_loop()
+        self.thread = threading.Thread(
+            target=self.loop.run_forever, name="sa_gwdata event loop", daemon=True
+        )
+        self.thread.start()
+
+    def session(self):
+        """Return the session for the current worker thread."""
+        if not hasattr(self.local, "session"):
+            self.local.session = self.session_factory()
+        return self.local.session
+
+    def _call_with_session(self, func, args, kwargs):
+        return func(self.session(), *args, **kwargs)
+
+    def semaphore(self, host):
+        """Return the semaphore limiting concurrent requests to *host*.
+        Must be called from the event loop."""
+        if not host in self.semaphores:
+            self.semaphores[host] = asyncio.Semaphore(self.max_per_host)
+        return self.semaphores[host]
+
+    async def call(self, host, func, *args, **kwargs):
+        """Coroutine which calls ``func(session, *args, **kwargs)`` in a
+        worker thread, subject to the per-host limit and the timeout.
+
+        Returns: the return value of func.
+
+        A worker thread cannot be interrupted, so a call which times out
+        keeps its place in the per-host limit until func actually
+        returns. Otherwise the requests started in its place would queue
+        for the busy worker threads and time out in turn.
+
+        """
+        semaphore = self.semaphore(host)
+        await semaphore.acquire()
+        try:
+            future = self.loop.run_in_executor(
+                self.executor,
+                functools.partial(self._call_with_session, func, args, kwargs),
+            )
+        except:
+            semaphore.release()
+            raise
+        future.add_done_callback(functools.partial(self._call_done, semaphore))
+        return await asyncio.wait_for(asyncio.shield(future), self.timeout)
+
+    def _call_done(self, semaphore, future):
+        semaphore.release()
+        if not future.cancelled():
+            # Retrieve the exception of calls which timed out, so that it
+            # is not logged as never retrieved.
+            future.exception()
+
+    def submit(self, coro):
+        """Schedule a coroutine on the event loop from another thread.
+
+        Returns: concurrent.futures.Future
+
+        """
+        return asyncio.run_coroutine_threadsafe(coro, self.loop)
+
+    def run(self, coro):
+        """Run a coroutine on the event loop and wait for its result.
+        Must not be called from the event loop thread."""
+        return self.submit(coro).result()
+
+    async def _cancel_all(self):
+        """Cancel every other coroutine on the event loop and wait until
+        they have all handled the cancellation."""
+        tasks = [x for x in asyncio.all_tasks() if x is not asyncio.current_task()]
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+
+    def _close(self):
+        """Wait for the worker threads, then stop and close the event loop.
+        The loop keeps running until then, so that the results of calls
+        still in the worker threads can be delivered to it."""
+        self.executor.shutdown(wait=True)
+        self.loop.call_soon_threadsafe(self.loop.stop)
+        self.thread.join()
+        self.loop.close()
+
+    def shutdown(self):
+        """Stop the event loop and the worker threads.
+
+        Coroutines which are still running are cancelled first, so the
+        futures returned by ``submit()`` for them are all done (cancelled)
+        when this returns. Calls already running in worker threads cannot
+        be interrupted; the loop is closed in the background once they
+        have returned.
+
+        """
+        self.run(self._cancel_all())
+        threading.Thread(
+            target=self._close, name="sa_gwdata event loop shutdown", daemon=True
+        ).start()
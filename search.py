@@ -0,0 +1,158 @@
+from bisect import bisect_left
+import re
+
+from qgis.PyQt.QtCore import QStringListModel, Qt
+from qgis.PyQt.QtWidgets import QCompleter, QLineEdit
+from qgis.core import NULL
+
+from .utils import *
+
+
+def format_search_value(value):
+    """Convert a value to text, without the ".0" of integral floats such
+    as permit numbers read from a layer as 123456.0."""
+    if isinstance(value, float) and value.is_integer():
+        value = int(value)
+    return str(value)
+
+
+def normalise_search_key(value):
+    """Lower-case a value and strip everything except letters and digits,
+    so that e.g. "6628-12345", "6628 12345" and "662812345" all match."""
+    return re.sub(r"[^0-9a-z]", "", format_search_value(value).lower())
+
+
+class WellSearchIndex:
+    """Prefix index over well identifiers.
+
+    Args:
+        columns (list): attribute names to index. The "name" column is
+            also indexed word by word.
+
+    Keys are held in a sorted list of ``(key, feature id)`` tuples, so a
+    prefix lookup is a binary search followed by a short scan.
+
+    """
+
+    def __init__(self, columns=SEARCH_COLUMNS):
+        self.columns = columns
+        self.clear()
+
+    def clear(self):
+        self.keys = []
+        self.labels = {}
+
+    def __len__(self):
+        return len(self.labels)
+
+    def add(self, rows):
+        """Add wells to the index.
+
+        Args:
+            rows (iterable): tuples of (feature id, dict of attributes)
+
+        """
+        keys = []
+        for fid, values in rows:
+            parts = []
+            for col in self.columns:
+                value = values.get(col)
+                if value is None or value == NULL or value == "" or value != value:
+                    continue
+                parts.append(format_search_value(value))
+                words = [value]
+                if col == "name":
+                    words += str(value).split()
+                for word in words:
+                    key = normalise_search_key(word)
+                    if key:
+                        keys.append((key, fid))
+            if parts:
+                self.labels[fid] = " | ".join(parts)
+        # The existing keys and the new keys are each sorted runs, which
+        # list.sort() merges in linear time.
+        keys.sort()
+        self.keys.extend(keys)
+        self.keys.sort()
+
+    def add_features(self, features, names):
+        """Add QgsFeatures to the index.
+
+        Args:
+            features (list): QgsFeature objects, with valid feature IDs.
+            names (list): the field names of the features.
+
+        """
+        self.add(
+            (feature.id(), dict(zip(names, feature.attributes())))
+            for feature in features
+        )
+
+    def add_layer(self, vlayer):
+        """Add all features of a vector layer to the index."""
+        self.add_features(vlayer.getFeatures(), vlayer.fields().names())
+
+    def search(self, text, limit=20):
+        """Find wells with an identifier starting with *text*.
+
+        Returns: list of (feature id, label) tuples.
+
+        """
+        prefix = normalise_search_key(text)
+        if not prefix:
+            return []
+        results = []
+        found = set()
+        i = bisect_left(self.keys, (prefix,))
+        while i < len(self.keys) and len(results) < limit:
+            key, fid = self.keys[i]
+            if not key.startswith(prefix):
+                break
+            if not fid in found:
+                found.add(fid)
+                results.append((fid, self.labels[fid]))
+            i += 1
+        return results
+
+
+class WellSearchBox(QLineEdit):
+    """Search box for wells in the plugin's "wells" layer.
+
+    Args:
+        plugin (SAGwDataPlugin object): the plugin object, which has the
+            ``wells_layer`` and ``search_index`` attributes.
+
+    Matching wells are shown as the user types. Picking one selects it
+    in the wells layer and zooms the map canvas to it.
+
+    """
+
+    def __init__(self, plugin, parent=None):
+        super().__init__(parent)
+        self.plugin = plugin
+        self.results = {}
+        self.setPlaceholderText("Search wells...")
+        self.setClearButtonEnabled(True)
+        self.setMaximumWidth(250)
+        self.model = QStringListModel(self)
+        self.completer = QCompleter(self.model, self)
+        self.completer.setCompletionMode(QCompleter.UnfilteredPopupCompletion)
+        self.completer.setCaseSensitivity(Qt.CaseInsensitive)
+        self.setCompleter(self.completer)
+        self.textEdited.connect(self.update_results)
+        self.completer.activated[str].connect(self.result_chosen)
+
+    def update_results(self, text):
+        results = self.plugin.search_index.search(text)
+        self.results = {label: fid for fid, label in results}
+        self.model.setStringList([label for fid, label in results])
+        if results:
+            self.completer.complete()
+
+    def result_chosen(self, label):
+        layer = self.plugin.wells_layer
+        if layer is None or not label in self.results:
+            return
+        layer.selectByIds([self.results[label]])
+        self.plugin.iface.setActiveLayer(layer)
+        self.plugin.iface.mapCanvas().zoomToSelected(layer)
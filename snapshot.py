@@ -0,0 +1,350 @@
+import json
+import os
+import struct
+import tempfile
+import threading
+import time
+import zipfile
+
+from qgis.PyQt.QtCore import QDateTime, QVariant
+
+from .install_dependencies import *
+
+import pandas as pd
+import pyarrow as pa
+import pyarrow.compute as pc
+
+from .utils import *
+
+SNAPSHOT_VERSION = 1
+SNAPSHOT_COMPRESSION = "zstd"
+SNAPSHOT_BATCH_ROWS = 65536
+SNAPSHOT_FILE_FILTER = "SA Groundwater Data snapshot (*.zip)"
+
+
+class ObservationCache:
+    """Observation data already downloaded from Groundwater Data, kept
+    per bulk download service (e.g. "GetWaterLevelDownload").
+
+    Args:
+        max_age (float): optional, seconds after which downloaded data
+            expires and is downloaded again when it is next needed.
+        max_rows (int): optional, the most rows of downloaded data to
+            keep. The oldest downloads are dropped first.
+
+    Downloaded data is held as pyarrow Tables. Data loaded from a snapshot
+    stays in the snapshot file, which is memory-mapped, and is decompressed
+    one record batch at a time when it is queried. It never expires and
+    does not count towards *max_rows*.
+
+    Each drillhole number belongs to the first source which was added
+    for it. Data for it in any later source is ignored, so the same wells
+    are never returned twice.
+
+    """
+
+    def __init__(self, max_age=None, max_rows=None):
+        self.max_age = max_age
+        self.max_rows = max_rows
+        self.lock = threading.RLock()
+        self.sources = {}
+        self.requested = {}
+        self.mapped_files = set()
+
+    def dh_nos(self, service):
+        """Return the set of drillhole numbers which have already been
+        requested from *service*."""
+        with self.lock:
+            return set(self.requested.get(service, set()))
+
+    def claim(self, service, dh_nos):
+        """Record drillhole numbers as requested, and return the set of
+        those which were not already."""
+        with self.lock:
+            requested = self.requested.setdefault(service, set())
+            new = set(int(dh_no) for dh_no in dh_nos) - requested
+            requested.update(new)
+            return new
+
+    def add(self, service, df, dh_nos):
+        """Add downloaded data to the cache.
+
+        Args:
+            service (str): bulk download service name
+            df (pandas.DataFrame): data as returned by ``bulk_download``
+            dh_nos (iterable): the drillhole numbers which were requested.
+                Wells without any data are remembered so that they are
+                not requested again.
+
+        """
+        with self.lock:
+            owned = set(int(dh_no) for dh_no in dh_nos) - self.dh_nos(service)
+            if not owned:
+                return
+            table = None
+            if len(df):
+                df = df[df.DHNO.isin(owned)]
+                if len(df):
+                    table = pa.Table.from_pandas(df, preserve_index=False)
+            # Only claimed once the conversion has worked, so that wells
+            # whose data could not be cached are requested again.
+            self.claim(service, owned)
+            self.sources.setdefault(service, []).append(
+                (table, owned, time.monotonic())
+            )
+            self.expire()
+
+    def add_reader(self, service, reader, dh_nos):
+        """Add a pyarrow RecordBatchFileReader (e.g. from a snapshot) to
+        the cache. *reader* is None for wells without any data."""
+        with self.lock:
+            owned = self.claim(service, dh_nos)
+            if owned:
+                self.sources.setdefault(service, []).append((reader, owned, None))
+
+    def update(self, other):
+        """Add the data held by another ObservationCache to this one."""
+        with self.lock:
+            for service in other.services():
+                for source, owned, added in other.sources.get(service, []):
+                    owned = self.claim(service, owned)
+                    if owned:
+                        self.sources.setdefault(service, []).append(
+                            (source, owned, added)
+                        )
+            self.mapped_files.update(other.mapped_files)
+            self.expire()
+
+    def _drop(self, service, entry):
+        """Remove one source, so that its wells are requested again."""
+        self.sources[service].remove(entry)
+        self.requested[service].difference_update(entry[1])
+
+    def expire(self):
+        """Drop downloaded data which is older than *max_age*, then the
+        oldest downloaded data until there are at most *max_rows* rows."""
+        with self.lock:
+            downloaded = [
+                (entry[2], service, entry)
+                for service, entries in self.sources.items()
+                for entry in entries
+                if entry[2] is not None
+            ]
+            downloaded.sort(key=lambda x: x[0])
+            if self.max_age is not None:
+                now = time.monotonic()
+                while downloaded and now - downloaded[0][0] > self.max_age:
+                    added, service, entry = downloaded.pop(0)
+                    self._drop(service, entry)
+            if self.max_rows is not None:
+                rows = sum(
+                    entry[0].num_rows
+                    for added, service, entry in downloaded
+                    if entry[0] is not None
+                )
+                while downloaded and rows > self.max_rows:
+                    added, service, entry = downloaded.pop(0)
+                    if entry[0] is not None:
+                        rows -= entry[0].num_rows
+                    self._drop(service, entry)
+
+    def clear(self):
+        """Drop all downloaded data. Data from snapshots is kept."""
+        with self.lock:
+            for service, entries in self.sources.items():
+                for entry in list(entries):
+                    if entry[2] is not None:
+                        self._drop(service, entry)
+
+    def services(self):
+        with self.lock:
+            return list(self.requested.keys())
+
+    def batches(self, service, dh_nos=None):
+        """Iterate over the record batches held for *service*, filtered
+        to the wells each source owns.
+
+        Args:
+            service (str): bulk download service name
+            dh_nos (set): optional, only return data for these wells.
+
+        """
+        with self.lock:
+            entries = list(self.sources.get(service, []))
+        for source, owned, added in entries:
+            wanted = owned if dh_nos is None else owned & dh_nos
+            if source is None or not wanted:
+                continue
+            if isinstance(source, pa.Table):
+                batches = source.to_batches()
+            else:
+                batches = (
+                    source.get_batch(i) for i in range(source.num_record_batches)
+                )
+            value_set = pa.array(sorted(wanted))
+            for batch in batches:
+                column = batch.column(batch.schema.get_field_index("DHNO"))
+                matches = batch.filter(
+                    pc.is_in(column, value_set=value_set.cast(column.type))
+                )
+                if matches.num_rows:
+                    yield matches
+
+    def get(self, service, dh_nos):
+        """Return the cached data for some wells.
+
+        Args:
+            service (str): bulk download service name
+            dh_nos (iterable): drillhole numbers
+
+        Returns: pandas.DataFrame (empty if nothing is cached).
+
+        """
+        dh_nos = set(int(dh_no) for dh_no in dh_nos)
+        frames = []
+        if dh_nos:
+            frames = [batch.to_pandas() for batch in self.batches(service, dh_nos)]
+        if frames:
+            return pd.concat(frames, ignore_index=True, sort=False)
+        return pd.DataFrame()
+
+    def to_df(self, service):
+        """Return all the cached data for *service* as one DataFrame."""
+        frames = [batch.to_pandas() for batch in self.batches(service)]
+        if frames:
+            return pd.concat(frames, ignore_index=True, sort=False)
+        return pd.DataFrame()
+
+
+def features_to_df(features, names):
+    """Convert the attributes of features to a pandas.DataFrame,
+    converting QGIS NULL and date/time values to their Python equivalents.
+
+    Args:
+        features (iterable): QgsFeature objects, e.g. from a
+            QgsVectorLayerFeatureSource, which is safe to use from a task.
+        names (list): the field names of the features.
+
+    """
+    rows = []
+    for feature in features:
+        values = []
+        for value in feature.attributes():
+            if isinstance(value, QVariant) and value.isNull():
+                value = None
+            elif isinstance(value, QDateTime):
+                value = value.toPyDateTime() if value.isValid() else None
+            values.append(value)
+        rows.append(dict(zip(names, values)))
+    df = pd.DataFrame(rows, columns=names)
+    for col in df.columns:
+        if col in WELL_DATE_COLUMNS:
+            df[col] = pd.to_datetime(df[col])
+        elif df[col].dtype.name[0].upper() in ("O", "S"):
+            df.loc[pd.isnull(df[col]), col] = ""
+    return df
+
+
+def _write_table(zf, arcname, df):
+    """Write a DataFrame to the ZIP archive *zf* as a compressed Arrow IPC
+    file."""
+    table = pa.Table.from_pandas(df, preserve_index=False)
+    sink = pa.BufferOutputStream()
+    options = pa.ipc.IpcWriteOptions(compression=SNAPSHOT_COMPRESSION)
+    with pa.ipc.new_file(sink, table.schema, options=options) as writer:
+        writer.write_table(table, max_chunksize=SNAPSHOT_BATCH_ROWS)
+    zf.writestr(arcname, sink.getvalue().to_pybytes())
+
+
+def write_snapshot(filename, wells_df, obs_cache):
+    """Save wells and cached observation data to a snapshot file.
+
+    Args:
+        filename (str): path of the snapshot file (a ZIP archive)
+        wells_df (pandas.DataFrame): wells, as held in the wells layer
+        obs_cache (ObservationCache): cached observation data
+
+    Each table is stored as an Arrow IPC file with compressed record
+    batches. The archive itself is not compressed, so that the tables can
+    be memory-mapped straight out of it by ``read_snapshot``.
+
+    The snapshot is written to a temporary file which then replaces
+    *filename*. A snapshot which *obs_cache* has memory-mapped cannot be
+    overwritten, and raises ValueError.
+
+    """
+    if os.path.realpath(filename) in obs_cache.mapped_files:
+        raise ValueError(
+            "{} is in use by the observation cache and cannot be "
+            "overwritten".format(filename)
+        )
+    manifest = {"version": SNAPSHOT_VERSION, "observations": {}}
+    fd, temp_filename = tempfile.mkstemp(
+        suffix=".tmp", dir=os.path.dirname(os.path.abspath(filename))
+    )
+    os.close(fd)
+    try:
+        with zipfile.ZipFile(temp_filename, "w", zipfile.ZIP_STORED) as zf:
+            _write_table(zf, "wells.arrow", wells_df)
+            for i, service in enumerate(obs_cache.services()):
+                arcname = "observations/{}.arrow".format(i)
+                df = obs_cache.to_df(service)
+                if len(df):
+                    _write_table(zf, arcname, df)
+                else:
+                    arcname = None
+                manifest["observations"][service] = {
+                    "table": arcname,
+                    "DHNOs": sorted(int(x) for x in obs_cache.dh_nos(service)),
+                }
+            zf.writestr("manifest.json", json.dumps(manifest))
+        os.replace(temp_filename, filename)
+    except:
+        os.remove(temp_filename)
+        raise
+
+
+def _member_offset(filename, info):
+    """Return the byte offset of the data of a stored ZIP archive member."""
+    with open(filename, "rb") as f:
+        f.seek(info.header_offset)
+        header = f.read(30)
+    name_length, extra_length = struct.unpack("<HH", header[26:30])
+    return info.header_offset + 30 + name_length + extra_length
+
+
+def read_snapshot(filename, obs_cache):
+    """Load a snapshot file saved by ``write_snapshot``.
+
+    Args:
+        filename (str): path of the snapshot file
+        obs_cache (ObservationCache): observation tables in the snapshot
+            are added to this cache, which then keeps the file
+            memory-mapped.
+
+    Returns: pandas.DataFrame of wells.
+
+    """
+    obs_cache.mapped_files.add(os.path.realpath(filename))
+    source = pa.memory_map(filename)
+    buffer = source.read_buffer()
+
+    def open_member(info):
+        offset = _member_offset(filename, info)
+        return pa.ipc.open_file(buffer.slice(offset, info.file_size))
+
+    with zipfile.ZipFile(filename, "r") as zf:
+        manifest = json.loads(zf.read("manifest.json").decode("utf-8"))
+        if manifest["version"] > SNAPSHOT_VERSION:
+            raise ValueError(
+                "Snapshot version {} is not supported".format(manifest["version"])
+            )
+        wells_df = open_member(zf.getinfo("wells.arrow")).read_pandas()
+        for service, entry in manifest["observations"].items():
+            if entry["table"] is None:
+                obs_cache.add_reader(service, None, entry["DHNOs"])
+            else:
+                obs_cache.add_reader(
+                    service, open_member(zf.getinfo(entry["table"])), entry["DHNOs"]
+                )
+    return wells_df
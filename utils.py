@@ -60,6 +60,22 @@ WELL_DATE_COLUMNS = [
     "latest_yield_date",
 ]
 
+WATERCONNECT_HOST = "www.waterconnect.sa.gov.au"
+
+# Maximum number of wells returned by a single find_wells_in_lat_lon request.
+WATERCONNECT_ROW_CAP = 10000
+
+# Number of wells per request when bulk downloads are split up for the
+# request engine.
+BULK_DOWNLOAD_CHUNK_SIZE = 50
+
+# Maximum number of times a rectangle is halved when it has more wells than
+# WATERCONNECT_ROW_CAP. More wells than that can share one location (e.g.
+# nested piezometers), so subdividing alone would never finish.
+MAX_SUBDIVISIONS = 20
+
+SEARCH_COLUMNS = ["unit_no.hyphen", "obs_no.id", "name", "permit_no"]
+
 EXTRACT_METHOD_KWS = {
     "BAIL": {"lw": 0.5, "marker": "v", "mfc": "none", "mew": 1},
     "PUMP": {"lw": 1, "marker": ".", "ms": 8},
@@ -102,8 +118,15 @@ def apply_well_id(row, cols=["Obs_No", "Unit_No"]):
     return ""
 
 
-def df_to_vector_layer(df, vlayer=None, name="wells", xcol="lon", ycol="lat"):
-    """Convert pandas.DataFrame to vector layer."""
+def df_to_vector_layer(
+    df, vlayer=None, name="wells", xcol="lon", ycol="lat", search_index=None
+):
+    """Convert pandas.DataFrame to vector layer.
+
+    If *search_index* (a WellSearchIndex) is given, the features added
+    to the layer are also added to it.
+
+    """
     if vlayer is None:
         create_vlayer = True
     else:
@@ -155,6 +178,78 @@ def df_to_vector_layer(df, vlayer=None, name="wells", xcol="lon", ycol="lat"):
             values.append(value)
         fet.setAttributes(values)
         features.append(fet)
-    pr.addFeatures(features)
+    ok, features = pr.addFeatures(features)
     vlayer.commitChanges()
+    if ok and search_index is not None:
+        search_index.add_features(features, names)
     return vlayer
+
+
+def highlight_layer_source(vlayer, dh_nos):
+    """Return the data source for a virtual layer showing a subset of
+    wells from another layer. See ``highlight_layer``."""
+    definition = QgsVirtualLayerDefinition()
+    definition.addSource("wells", vlayer.id())
+    definition.setQuery(
+        "SELECT * FROM wells WHERE dh_no IN ({})".format(
+            ", ".join([str(int(dh_no)) for dh_no in dh_nos])
+        )
+    )
+    return definition.toString()
+
+
+def highlight_layer(vlayer, dh_nos, name):
+    """Create a virtual layer showing a subset of wells from another layer.
+
+    Args:
+        vlayer (QgsVectorLayer): the layer containing the wells, which must
+            be registered in the current project.
+        dh_nos (iterable): drillhole numbers of the wells to show.
+        name (str): name of the new layer.
+
+    The virtual layer queries ``vlayer`` directly, so no feature data
+    is copied into it.
+
+    """
+    return QgsVectorLayer(highlight_layer_source(vlayer, dh_nos), name, "virtual")
+
+
+# Symbols for well_id_renderer, by geometry type and colour. The number
+# of colours in use is small, as they come from a fixed palette.
+_symbol_templates = {}
+
+
+def well_symbol(geometry_type, colour):
+    """Return a new symbol of the given colour.
+
+    Args:
+        geometry_type (QgsWkbTypes.GeometryType): geometry type of the layer
+        colour (tuple): RGB with values from 0 to 1
+
+    """
+    key = (int(geometry_type), tuple(colour))
+    if not key in _symbol_templates:
+        symbol = QgsSymbol.defaultSymbol(geometry_type)
+        qcolor = QColor.fromRgbF(*colour)
+        for symbol_layer in symbol.symbolLayers():
+            symbol_layer.setFillColor(qcolor)
+        _symbol_templates[key] = symbol
+    return _symbol_templates[key].clone()
+
+
+def well_id_renderer(geometry_type, styles):
+    """Create a renderer with a coloured category for each well.
+
+    Args:
+        geometry_type (QgsWkbTypes.GeometryType): geometry type of the layer
+        styles (pandas.DataFrame): indexed by well_id, with "colour"
+            (RGB tuples with values from 0 to 1) and "label" columns.
+
+    Returns: QgsCategorizedSymbolRenderer
+
+    """
+    categories = [
+        QgsRendererCategory(well_id, well_symbol(geometry_type, colour), label)
+        for well_id, colour, label in zip(styles.index, styles.colour, styles.label)
+    ]
+    return QgsCategorizedSymbolRenderer("well_id", categories)